@@ -1,11 +1,34 @@
 import streamlit as st
 import openai
 import json
+import orjson
+import html
+from urllib.parse import quote, urlsplit
 import re
+import operator
+import heapq
+import asyncio
+import threading
 from datetime import datetime, timedelta
 import requests
+import numpy as np
+from numba import njit
+from sklearn.feature_extraction.text import TfidfVectorizer
+from requests.adapters import HTTPAdapter
 from typing import List, Dict
 
+# --- LLM Settings ---
+GENERATION_MODEL = "gpt-4o-mini"
+GENERATION_MAX_TOKENS = 500
+FILTER_MODEL = "gpt-4o-mini"
+FILTER_CHUNK_SIZE = 12  # offers per filter request
+FILTER_MAX_CONCURRENCY = 8  # in-flight filter requests, kept under rate limits
+FILTER_TIMEOUT = 15  # seconds per filter request
+FILTER_TOP_K = 40  # most query-relevant offers sent to the LLM
+
+# --- PulseID API Settings ---
+LMS_TIMEOUT = (3, 10)  # (connect, read) seconds
+
 # --- Initialize Session State ---
 if 'offer_params' not in st.session_state:
     st.session_state.offer_params = None
@@ -25,21 +48,47 @@ if 'filtered_offers' not in st.session_state:
     st.session_state.filtered_offers = None
 if 'offers_loaded' not in st.session_state:
     st.session_state.offers_loaded = False
+if 'offers_soa' not in st.session_state:
+    st.session_state.offers_soa = None
+if 'offers_tfidf' not in st.session_state:
+    st.session_state.offers_tfidf = None
+if 'page_size' not in st.session_state:
+    st.session_state.page_size = 20
+if 'page_index' not in st.session_state:
+    st.session_state.page_index = 1
 if 'insufficient_data' not in st.session_state:
     st.session_state.insufficient_data = False
 
 # --- Helper Functions ---
+@st.cache_resource
+def _openai() -> openai.OpenAI:
+    """OpenAI client shared across reruns and tabs"""
+    return openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+def set_filtered_offers(offers):
+    """Replace the displayed offer subset and go back to the first page"""
+    st.session_state.filtered_offers = offers
+    st.session_state.page_index = 1
+
 def format_currency(amount):
     return f"\\${amount:.2f}"  # Escaped for Markdown
 
+@st.cache_resource
+def _lms_session() -> requests.Session:
+    """Keep-alive session shared across reruns so LMS calls reuse TCP/TLS connections"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+@st.cache_resource(ttl=3000, show_spinner=False)
 def authenticate_user(email: str, password: str, app: str):
     url = 'https://lmsdev.pulseid.com/1.0/auth/login-v2'
-    headers = {'Content-Type': 'application/json'}
     payload = {'email': email, 'password': password, 'app': app}
-    response = requests.post(url, headers=headers, json=payload)
+    response = _lms_session().post(url, json=payload, timeout=LMS_TIMEOUT)
     if not response.ok:
         raise Exception('Authentication failed')
-    auth_data = response.json()
+    auth_data = orjson.loads(response.content)
     return {
         'permissionToken': auth_data['data']['auth'][0]['permissionToken'],
         'authToken': auth_data['data']['auth'][0]['authToken']
@@ -50,13 +99,17 @@ def get_pending_offers(permission_token: str, auth_token: str):
     headers = {
         'x-pulse-current-client': '315',
         'x-pulse-token': permission_token,
-        'Authorization': f'Bearer {auth_token}',
-        'Content-Type': 'application/json'
+        'Authorization': f'Bearer {auth_token}'
     }
-    response = requests.get(url, headers=headers)
+    response = _lms_session().get(url, headers=headers, timeout=LMS_TIMEOUT)
     if response.status_code != 200:
         raise Exception('Failed to retrieve offers')
-    return response.json()
+    return orjson.loads(response.content)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_pending(permission_token: str, auth_token: str):
+    """Cache pending offers per token so reruns don't hit the API"""
+    return get_pending_offers(permission_token, auth_token)
 
 def fetch_pending_offers():
     try:
@@ -65,76 +118,310 @@ def fetch_pending_offers():
             password=st.session_state.lms_credentials['password'],
             app=st.session_state.lms_credentials['app']
         )
-        offers = get_pending_offers(auth['permissionToken'], auth['authToken'])
-        st.session_state.pending_offers = offers.get('offers', [])
+        offers = _cached_pending(auth['permissionToken'], auth['authToken'])
+        pending = offers.get('offers', [])
+        for offer in pending:
+            offer['_expiry_dt'] = parse_expiry(offer)
+            offer['_enrichment'] = _enrichment_store()['results'].get(enrichment_key(offer))
+            offer['_summary'] = summarize_offer(offer)
+        st.session_state.pending_offers = pending
+        st.session_state.offers_soa = build_offers_soa(pending)
+        st.session_state.offers_tfidf = build_tfidf_index(pending)
         st.session_state.offers_loaded = True
         return offers
     except Exception as e:
+        # A rejected call may mean a stale token; log in again on the next attempt
+        authenticate_user.clear()
         st.error(f"Failed to fetch offers: {str(e)}")
         return None
 
+# Static filter instruction; each chunk's offers are appended after it and the query goes last
+FILTER_INSTRUCTION = """Analyze the offers below and return ONLY a JSON list of offer IDs that match the user's query.
+Each offer is one line of pipe-separated fields:
+ID, T=title, M=merchant, C=category, E=expiry date, B=budget, R=reward type,
+and when available N=normalized category, G=tags
+Important:
+- Understand categories (e.g., 'kids' = toys/baby items)
+- Recognize dates in any format
+- Handle currency values flexibly
+- If no offers match, return empty list
+Return format: {"matching_ids": [id1, id2, ...]}
+Available offers:"""
+
+async def _filter_chunk(client, semaphore, prompt: str, chunk: List[Dict]) -> List:
+    """Ask the LLM which offers in a single chunk match the query"""
+    offers_block = "\n".join(offer['_summary'] for offer in chunk)
+    async with semaphore:
+        response = await client.chat.completions.create(
+            model=FILTER_MODEL,
+            messages=[
+                {"role": "system", "content": f"{FILTER_INSTRUCTION}\n{offers_block}"},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.1,
+            response_format={"type": "json_object"},
+            timeout=FILTER_TIMEOUT
+        )
+    content = response.choices[0].message.content
+    if not content or not content.strip():
+        return []
+    return orjson.loads(content).get("matching_ids", [])
+
+async def _filter_chunks(prompt: str, chunks: List[List[Dict]]) -> List[List]:
+    # The async client's connection pool is bound to the running event loop,
+    # so it lives for one search and is shared by all of its chunk requests
+    async with openai.AsyncOpenAI(api_key=_openai().api_key) as client:
+        semaphore = asyncio.Semaphore(FILTER_MAX_CONCURRENCY)
+        return await asyncio.gather(*[
+            _filter_chunk(client, semaphore, prompt, chunk) for chunk in chunks
+        ])
+
+@st.cache_data(ttl=600, max_entries=128, show_spinner=False)
+def _filter_matching_ids(prompt: str, offers_key: tuple, _offers: List[Dict]) -> List:
+    """Return the IDs of offers matching the prompt, cached per query and offer set"""
+    # Id order keeps chunking deterministic for a given candidate set
+    ordered = sorted(_offers, key=lambda o: str(o.get('id')))
+    chunks = [ordered[i:i + FILTER_CHUNK_SIZE] for i in range(0, len(ordered), FILTER_CHUNK_SIZE)]
+    results = asyncio.run(_filter_chunks(prompt, chunks))
+    return list({offer_id for ids in results for offer_id in ids})
+
+# Words that carry no constraint of their own
+FILLER_WORDS = {
+    'show', 'find', 'give', 'list', 'get', 'me', 'all', 'any', 'the', 'a', 'an', 'with', 'that',
+    'are', 'is', 'what', 'which', 'please', 'offer', 'offers', 'deal', 'deals', 'budget', 'value',
+}
+# Constraint words that never appear in offer summaries, so they are useless for keyword matching
+NON_KEYWORD_WORDS = FILLER_WORDS | {
+    'from', 'have', 'about', 'expiring', 'expire', 'expires', 'soon', 'over', 'above',
+    'under', 'below', 'more', 'less', 'than', 'least', 'most', 'worth',
+}
+# Amounts followed by % are discounts, not budgets
+BUDGET_QUERY_RE = re.compile(
+    r'(>=|<=|>|<|\bat least\b|\bat most\b|\bmore than\b|\bless than\b|\bover\b|\babove\b|\bunder\b|\bbelow\b)'
+    r'\s*\$?\s*(\d+(?:\.\d+)?)(?![\d.])(?!\s*%)'
+)
+BUDGET_COMPARISONS = {
+    '>': operator.gt, 'over': operator.gt, 'above': operator.gt, 'more than': operator.gt,
+    '>=': operator.ge, 'at least': operator.ge,
+    '<': operator.lt, 'under': operator.lt, 'below': operator.lt, 'less than': operator.lt,
+    '<=': operator.le, 'at most': operator.le,
+}
+
+def query_keywords(prompt: str) -> List[str]:
+    return [word for word in re.findall(r'\w{4,}', prompt.lower()) if word not in NON_KEYWORD_WORDS]
+
+def prefilter_offers(prompt: str, offers: List[Dict]) -> List[Dict]:
+    """Narrow offers by keyword before the LLM; falls back to all offers when nothing matches"""
+    keywords = query_keywords(prompt)
+    if not keywords:
+        return offers
+    matches = [offer for offer in offers if any(word in offer['_summary'].lower() for word in keywords)]
+    return matches or offers
+
+def budget_query_filter(prompt: str, offers: List[Dict]):
+    """Answer pure budget queries like 'over $50' without the LLM; None if the query needs it"""
+    query = prompt.lower()
+    match = BUDGET_QUERY_RE.search(query)
+    if not match:
+        return None
+    # Anything besides the budget phrase and filler (e.g. 'expiring soon', 'food') needs the LLM
+    rest = query[:match.start()] + " " + query[match.end():]
+    if any(word not in FILLER_WORDS for word in re.findall(r'[a-z0-9]+', rest)):
+        return None
+    compare, amount = BUDGET_COMPARISONS[match.group(1)], float(match.group(2))
+    return [offer for offer in offers if compare(safe_float(offer.get('budget')), amount)]
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _tfidf_index(summaries: tuple):
+    vectorizer = TfidfVectorizer(max_features=4096, ngram_range=(1, 2))
+    return vectorizer, vectorizer.fit_transform(summaries)
+
+def build_tfidf_index(offers: List[Dict]):
+    """TF-IDF matrix over offer summaries, used to pre-rank offers for a query"""
+    if not offers:
+        return None
+    vectorizer, matrix = _tfidf_index(tuple(offer['_summary'] for offer in offers))
+    return {
+        'vectorizer': vectorizer,
+        'matrix': matrix,
+        'row_by_id': {offer.get('id'): row for row, offer in enumerate(offers)},
+    }
+
+def top_k_offers(prompt: str, offers: List[Dict], k: int = FILTER_TOP_K) -> List[Dict]:
+    """Keep the k offers whose summaries are most similar to the query"""
+    index = st.session_state.offers_tfidf
+    if index is None or len(offers) <= k:
+        return offers
+    rows = [index['row_by_id'][offer.get('id')] for offer in offers]
+    # Rows are L2-normalized, so the dot product is the cosine similarity
+    scores = (index['matrix'][rows] @ index['vectorizer'].transform([prompt]).T).toarray().ravel()
+    # Without k offers sharing terms with the query the ranking would be arbitrary,
+    # so leave semantic matching to the LLM
+    if np.count_nonzero(scores) <= k:
+        return offers
+    top = np.argpartition(-scores, k)[:k]
+    return [offers[i] for i in sorted(top)]
+
 def filter_offers_with_llm(prompt: str, offers: List[Dict]) -> List[Dict]:
     """Use LLM to filter offers based on natural language prompt"""
     if not prompt or not offers:
         return []
     
+    budget_matches = budget_query_filter(prompt, offers)
+    if budget_matches is not None:
+        return budget_matches
+    
     try:
-        client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-        
-        # Prepare offers data for LLM
-        offers_str = "\n".join([
-            f"ID: {offer.get('id')}, "
-            f"Title: {offer.get('title')}, "
-            f"Merchant: {offer.get('merchants', [{}])[0].get('name', 'N/A')}, "
-            f"Category: {offer.get('merchants', [{}])[0].get('category', 'N/A')}, "
-            f"Expires: {offer.get('duration', {}).get('to', 'N/A')}, "
-            f"Budget: {safe_float(offer.get('budget'))}, "
-            f"Type: {offer.get('rewardType', 'N/A')}"
-            for offer in offers[:100]  # Limit to 100 offers
-        ])
+        candidates = prefilter_offers(prompt, offers)
+        # Only rank real keyword hits; when the prefilter fell back to every offer
+        # the query is semantic (e.g. 'kids') and all offers must reach the LLM
+        if candidates is not offers:
+            candidates = top_k_offers(prompt, candidates)
+        # Offers are excluded from the cache hash; this key identifies the set instead
+        offers_key = tuple(sorted(
+            (str(o.get('id')), o.get('updatedAt', ''), o.get('_enrichment') is not None) for o in candidates
+        ))
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""Analyze these offers and return ONLY a JSON list of offer IDs that match the user's query.
-                    Available offers:\n{offers_str}\n
-                    Important:
-                    - Understand categories (e.g., 'kids' = toys/baby items)
-                    - Recognize dates in any format
-                    - Handle currency values flexibly
-                    - If no offers match, return empty list
-                    Return format: {{"matching_ids": [id1, id2, ...]}}"""
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.1,
-            response_format={"type": "json_object"}
-        )
-        
-        # Safely parse the response
         try:
-            content = response.choices[0].message.content
-            if not content.strip():
-                return []
-            
-            result = json.loads(content)
-            matching_ids = result.get("matching_ids", [])
-            
-            if not matching_ids:
-                return []
-                
-            return [offer for offer in offers if offer.get('id') in matching_ids]
-            
-        except json.JSONDecodeError:
+            matching_ids = set(_filter_matching_ids(prompt, offers_key, candidates))
+        except orjson.JSONDecodeError:
             st.warning("The AI had trouble understanding your request. Please try a different search.")
             return []
+        
+        if not matching_ids:
+            return []
+        
+        return [offer for offer in candidates if offer.get('id') in matching_ids]
             
     except Exception as e:
         st.error(f"Search error: {str(e)}")
         return []
 
+# --- Offer Enrichment (OpenAI Batch API) ---
+ENRICHMENT_INSTRUCTION = """Normalize this offer's category and tag it for search.
+Return JSON: {"category": "one or two word category", "tags": ["short", "lowercase", "tags"]}"""
+
+def enrichment_summary(enrichment) -> str:
+    if not enrichment:
+        return ""
+    return f"|N:{enrichment.get('category', 'N/A')}|G:{','.join(enrichment.get('tags', []))}"
+
+def enrichment_key(offer: Dict) -> str:
+    """Identifies an offer version, so edited offers are enriched again"""
+    return f"{offer.get('id')}|{offer.get('updatedAt', '')}"
+
+@st.cache_resource
+def _enrichment_store() -> Dict:
+    """Process-wide batch state, so results outlive the browser session that queued them"""
+    return {
+        'lock': threading.Lock(),
+        'results': {},  # enrichment_key -> {"category": ..., "tags": [...]}
+        'batches': {},  # batch id -> enrichment keys it covers
+    }
+
+def submit_enrichment_batch(offers: List[Dict]):
+    """Queue category/tag enrichment as a 24h OpenAI batch for offers not yet enriched or queued"""
+    store = _enrichment_store()
+    with store['lock']:
+        queued = {key for keys in store['batches'].values() for key in keys}
+        todo = [
+            offer for offer in offers
+            if enrichment_key(offer) not in store['results'] and enrichment_key(offer) not in queued
+        ]
+        if not todo:
+            return None
+        lines = [
+            json.dumps({
+                "custom_id": enrichment_key(offer),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": FILTER_MODEL,
+                    "messages": [
+                        {"role": "system", "content": ENRICHMENT_INSTRUCTION},
+                        {"role": "user", "content": offer['_summary']},
+                    ],
+                    "temperature": 0.1,
+                    "response_format": {"type": "json_object"}
+                }
+            })
+            for offer in todo
+        ]
+        client = _openai()
+        batch_file = client.files.create(
+            file=("offer_enrichment.jsonl", "\n".join(lines).encode()),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        store['batches'][batch.id] = [enrichment_key(offer) for offer in todo]
+        return batch.id
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _batch_status(batch_id: str) -> Dict:
+    """Batch status, polled at most once a minute"""
+    batch = _openai().batches.retrieve(batch_id)
+    return {'status': batch.status, 'output_file_id': batch.output_file_id}
+
+def poll_enrichment_batches():
+    """Collect results of finished batches into the process-wide store"""
+    store = _enrichment_store()
+    for batch_id in list(store['batches']):
+        try:
+            batch = _batch_status(batch_id)
+            if batch['status'] in ("failed", "expired", "cancelled"):
+                # Its offers become eligible for the next refresh
+                store['batches'].pop(batch_id, None)
+                continue
+            if batch['status'] != "completed":
+                continue
+            
+            output = _openai().files.content(batch['output_file_id']).text
+            results = {}
+            for line in output.splitlines():
+                # One malformed result shouldn't discard the rest of the batch
+                try:
+                    result = orjson.loads(line)
+                    if result.get('error') or result['response']['status_code'] != 200:
+                        continue
+                    content = result['response']['body']['choices'][0]['message']['content']
+                    enrichment = orjson.loads(content)
+                    # Shared by every session, so only well-formed results are kept
+                    if not (
+                        isinstance(enrichment, dict)
+                        and isinstance(enrichment.get('category'), str)
+                        and isinstance(enrichment.get('tags'), list)
+                        and all(isinstance(tag, str) for tag in enrichment['tags'])
+                    ):
+                        continue
+                    results[result['custom_id']] = {
+                        'category': enrichment['category'],
+                        'tags': enrichment['tags'],
+                    }
+                except (orjson.JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+                    continue
+            with store['lock']:
+                store['results'].update(results)
+                store['batches'].pop(batch_id, None)
+        except Exception as e:
+            st.warning(f"Offer enrichment check failed: {str(e)}")
+
+def apply_enrichment():
+    """Attach any newly available enrichment to this session's offers"""
+    results = _enrichment_store()['results']
+    changed = False
+    for offer in st.session_state.pending_offers or []:
+        enrichment = results.get(enrichment_key(offer))
+        if enrichment is not None and offer.get('_enrichment') is None:
+            offer['_enrichment'] = enrichment
+            offer['_summary'] = summarize_offer(offer)
+            changed = True
+    if changed:
+        st.session_state.offers_tfidf = build_tfidf_index(st.session_state.pending_offers)
+
 def safe_float(value):
     """Safely convert to float handling None and strings"""
     if value is None:
@@ -144,43 +431,152 @@ def safe_float(value):
     except ValueError:
         return 0.0
 
+def parse_expiry(offer: Dict) -> datetime:
+    """Parse an offer's end date, using datetime.max when it has none"""
+    expiry_date = offer.get('duration', {}).get('to')
+    if expiry_date and expiry_date != "No end date":
+        try:
+            return datetime.strptime(expiry_date, "%Y-%m-%d %H:%M")
+        except ValueError:
+            pass
+    return datetime.max
+
+def summarize_offer(offer: Dict) -> str:
+    """Compact one-line offer description used in LLM prompts"""
+    merchant = offer.get('merchants', [{}])[0]
+    return (
+        f"ID:{offer.get('id')}"
+        f"|T:{offer.get('title')}"
+        f"|M:{merchant.get('name', 'N/A')}"
+        f"|C:{merchant.get('category', 'N/A')}"
+        f"|E:{offer.get('duration', {}).get('to', 'N/A')}"
+        f"|B:{safe_float(offer.get('budget'))}"
+        f"|R:{offer.get('rewardType', 'N/A')}"
+    ) + enrichment_summary(offer.get('_enrichment'))
+
+def build_offers_soa(offers: List[Dict]) -> Dict:
+    """Column arrays over the offer list so quick filters are vectorized masks"""
+    return {
+        # Filters return row positions into this list, so id types never matter
+        'offers': offers,
+        # Epoch seconds, compared against "now" when a filter runs; no expiry is +inf
+        'expiry_ts': np.array(
+            [np.inf if o['_expiry_dt'] == datetime.max else o['_expiry_dt'].timestamp() for o in offers],
+            dtype='f8'
+        ),
+        'budget': np.array([safe_float(o.get('budget')) for o in offers], dtype='f4'),
+    }
+
+def offers_from_rows(soa: Dict, rows: np.ndarray) -> List[Dict]:
+    return [soa['offers'][row] for row in rows.tolist()]
+
+# Below this many offers NumPy masking beats the JIT loops
+NUMBA_MIN_OFFERS = 1000
+
+# Plain kernels; _jit_filters compiles them once per process
+def _filter_expiry(expiry_ts, now_ts, window):
+    out = np.empty(expiry_ts.size, np.int64)
+    n = 0
+    for i in range(expiry_ts.size):
+        if 0 <= expiry_ts[i] - now_ts < window:
+            out[n] = i
+            n += 1
+    return out[:n]
+
+def _filter_budget(budget, thresh):
+    out = np.empty(budget.size, np.int64)
+    n = 0
+    for i in range(budget.size):
+        if budget[i] > thresh:
+            out[n] = i
+            n += 1
+    return out[:n]
+
+@st.cache_resource(show_spinner=False)
+def _jit_filters() -> Dict:
+    """Compile and warm the JIT filters once per process, outside the click path"""
+    # Decorating at module level would make fresh, cold dispatchers on every rerun
+    filters = {
+        'expiry': njit(cache=True)(_filter_expiry),
+        'budget': njit(cache=True)(_filter_budget),
+    }
+    filters['expiry'](np.zeros(1, dtype='f8'), 0.0, 1.0)
+    filters['budget'](np.zeros(1, dtype='f4'), 50.0)
+    return filters
+
+def expiring_soon_rows(soa: Dict, max_days: int = 7) -> np.ndarray:
+    """Rows expiring within max_days whole days from now, matching the cards' 'Expires in'"""
+    expiry_ts = soa['expiry_ts']
+    now_ts = datetime.now().timestamp()
+    window = (max_days + 1) * 86400.0
+    if expiry_ts.size >= NUMBA_MIN_OFFERS:
+        return _jit_filters()['expiry'](expiry_ts, now_ts, window)
+    remaining = expiry_ts - now_ts
+    return np.flatnonzero((remaining >= 0) & (remaining < window))
+
+def high_value_rows(soa: Dict, min_budget: float = 50.0) -> np.ndarray:
+    budget = soa['budget']
+    if budget.size >= NUMBA_MIN_OFFERS:
+        return _jit_filters()['budget'](budget, min_budget)
+    return np.flatnonzero(budget > min_budget)
+
 # --- UI Components ---
-def offer_card(offer: Dict):
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/150?text=No+Image"
+
+def _html(value) -> str:
+    """Escape text for card HTML; $ is encoded so Markdown doesn't read it as LaTeX"""
+    return html.escape(str(value)).replace('$', '&#36;')
+
+def _image_css_url(url) -> str:
+    """Percent-encode an image URL for use inside CSS url(); non-http(s) values become the placeholder"""
+    url = str(url or '').strip()
+    if urlsplit(url).scheme not in ('http', 'https'):
+        url = PLACEHOLDER_IMAGE
+    return quote(url, safe=":/?#[]@!&*+,;=%~-._")
+
+def _card_html(offer: Dict) -> str:
     merchant = offer.get('merchants', [{}])[0]
-    image_url = (
+    image_url = _image_css_url(
         offer.get('offerLogo') or 
         merchant.get('profilePicture') or 
-        merchant.get('categoryLogo') or 
-        "https://via.placeholder.com/150?text=No+Image"
+        merchant.get('categoryLogo')
     )
     
     # Calculate days until expiration
-    expiry_date = offer.get('duration', {}).get('to')
-    days_left = "N/A"
-    if expiry_date and expiry_date != "No end date":
-        try:
-            expiry = datetime.strptime(expiry_date, "%Y-%m-%d %H:%M")
-            days_left = max(0, (expiry - datetime.now()).days)
-        except ValueError:
-            days_left = "N/A"
+    expiry = offer['_expiry_dt']
+    days_left = "N/A" if expiry == datetime.max else max(0, (expiry - datetime.now()).days)
+    symbol = offer.get('currency', {}).get('symbol', '$')
+    status = offer.get('status', 'N/A').replace('-', ' ').title()
     
-    with st.container():
-        cols = st.columns([1, 3])
-        with cols[0]:
-            st.image(image_url, use_container_width=True)
-        with cols[1]:
-            st.subheader(offer.get('title', 'Untitled Offer'))
-            st.markdown(f"""
-            **Merchant:** {merchant.get('name', 'N/A')}  
-            **Category:** {merchant.get('category', 'N/A')}  
-            **Value:** {offer.get('currency', {}).get('symbol', '\\$')}{offer.get('budget', 'N/A')}  
-            **Expires in:** {days_left} days  
-            **Status:** {offer.get('status', 'N/A').replace('-', ' ').title()}
-            """)
-            
-            if st.button("View Details", key=f"details_{offer.get('id')}"):
-                st.json(offer)
-        st.divider()
+    # Kept on unindented lines so Markdown passes it through as a raw HTML block
+    return (
+        f'<div class="offer-card">'
+        # Layered backgrounds: if the offer image fails to load, the placeholder below shows through
+        f'<div class="offer-thumb" style="background-image: url({_html(image_url)}), url({PLACEHOLDER_IMAGE})"></div>'
+        f'<div>'
+        f'<h3>{_html(offer.get("title", "Untitled Offer"))}</h3>'
+        f'<b>Merchant:</b> {_html(merchant.get("name", "N/A"))}<br>'
+        f'<b>Category:</b> {_html(merchant.get("category", "N/A"))}<br>'
+        f'<b>Value:</b> {_html(symbol)}{_html(offer.get("budget", "N/A"))}<br>'
+        f'<b>Expires in:</b> {days_left} days<br>'
+        f'<b>Status:</b> {_html(status)}'
+        f'</div></div>'
+    )
+
+def render_offer_cards(offers: List[Dict]):
+    """Render all cards in one Markdown element plus a single details panel"""
+    st.markdown("".join(_card_html(offer) for offer in offers), unsafe_allow_html=True)
+    
+    offers_by_id = {offer.get('id'): offer for offer in offers}
+    selected_id = st.selectbox(
+        "View Details",
+        options=[None, *offers_by_id],
+        format_func=lambda offer_id: "Select an offer..." if offer_id is None
+            else f"{offer_id} - {offers_by_id[offer_id].get('title', 'Untitled Offer')}"
+    )
+    if selected_id is not None:
+        # Derived fields (expiry datetime, prompt summary) are internal only
+        st.json({k: v for k, v in offers_by_id[selected_id].items() if not k.startswith('_')})
 
 # --- Main UI ---
 st.set_page_config(page_title="Offer Management Dashboard", page_icon="🎯", layout="wide")
@@ -197,11 +593,20 @@ st.markdown("""
         font-weight: 600;
     }
     .offer-card {
+        display: flex;
+        gap: 1.5rem;
         border-radius: 10px;
         box-shadow: 0 2px 8px rgba(0,0,0,0.1);
         padding: 1.5rem;
         margin-bottom: 1.5rem;
     }
+    .offer-card .offer-thumb {
+        flex: 0 0 150px;
+        height: 150px;
+        background-size: contain;
+        background-repeat: no-repeat;
+        background-position: center;
+    }
     .wide-button {
         width: 100%;
     }
@@ -219,6 +624,8 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+_jit_filters()
+
 # Main tabs
 tab1, tab2 = st.tabs(["✨ Create Offer", "📋 View Offers"])
 
@@ -239,9 +646,10 @@ with tab1:
             with st.spinner("Creating your offer..."):
                 try:
                     st.session_state.insufficient_data = False  # Reset flag
-                    client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+                    preview = st.empty()
+                    client = _openai()
                     response = client.chat.completions.create(
-                        model="gpt-4o",
+                        model=GENERATION_MODEL,
                         messages=[
                             {
                                 "role": "system",
@@ -268,12 +676,25 @@ with tab1:
                             {"role": "user", "content": user_prompt},
                         ],
                         temperature=0.2,
-                        response_format={"type": "json_object"}
+                        max_tokens=GENERATION_MAX_TOKENS,
+                        response_format={"type": "json_object"},
+                        stream=True
                     )
                     
-                    content = response.choices[0].message.content
-                    content = re.sub(r'```json\n?(.*?)\n?```', r'\1', content, flags=re.DOTALL)
-                    offer_data = json.loads(content)
+                    # Show the JSON as it streams in, then parse the full text
+                    content = ""
+                    finish_reason = None
+                    for chunk in response:
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if chunk.choices[0].delta.content:
+                            content += chunk.choices[0].delta.content
+                            preview.code(content, language="json")
+                    if finish_reason == "length":
+                        # Truncated JSON is a token-cap problem, not a vague description
+                        raise Exception("The generated offer was cut off. Please try a shorter description.")
+                    offer_data = orjson.loads(content)
                     
                     if "error" in offer_data and offer_data["error"] == "Not enough data to proceed":
                         st.session_state.insufficient_data = True
@@ -282,7 +703,7 @@ with tab1:
                         st.session_state.adjusted_params = st.session_state.offer_params.copy()
                         st.session_state.offer_created = True
                     st.rerun()
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     st.session_state.insufficient_data = True
                     st.rerun()
                 except Exception as e:
@@ -323,14 +744,11 @@ with tab1:
                         # Add your publish logic here
                         st.success("Offer published successfully!")
 
-with tab2:
-    st.title("Smart Offer Explorer")
-    st.caption("View, search, and analyze your offers using natural language")
-    
-    # Load offers automatically when tab is accessed
-    if not st.session_state.offers_loaded:
-        with st.spinner("Loading offers..."):
-            fetch_pending_offers()
+@st.fragment
+def offers_panel():
+    """Search, filters and offer list; widget clicks here rerun only this panel"""
+    poll_enrichment_batches()
+    apply_enrichment()
     
     # Two-column layout
     col1, col2 = st.columns([1, 3], gap="large")
@@ -348,32 +766,38 @@ with tab2:
             if st.button("Search Offers", type="primary"):
                 if st.session_state.pending_offers and search_query:
                     with st.spinner("Analyzing offers..."):
-                        st.session_state.filtered_offers = filter_offers_with_llm(
+                        set_filtered_offers(filter_offers_with_llm(
                             search_query, 
                             st.session_state.pending_offers
-                        )
+                        ))
                 elif not st.session_state.pending_offers:
                     st.warning("No offers loaded. Please try again.")
         
         with search_cols[1]:
             if st.button("Show All Offers", type="secondary"):
-                st.session_state.filtered_offers = None
+                set_filtered_offers(None)
+        
+        if st.button("Force Refresh"):
+            authenticate_user.clear()  # re-login in case the cached token was revoked
+            _cached_pending.clear()
+            set_filtered_offers(None)
+            with st.spinner("Refreshing offers..."):
+                fetch_pending_offers()
+            if st.session_state.pending_offers:
+                try:
+                    submit_enrichment_batch(st.session_state.pending_offers)
+                except Exception as e:
+                    st.warning(f"Could not queue offer enrichment: {str(e)}")
         
         st.divider()
         
         st.markdown("**Quick Filters:**")
-        if st.button("Expiring Soon (≤7 days)"):
-            st.session_state.filtered_offers = [
-                o for o in (st.session_state.pending_offers or []) 
-                if o.get('duration', {}).get('to') and 
-                (datetime.strptime(o['duration']['to'], "%Y-%m-%d %H:%M") - datetime.now()).days <= 7
-            ]
+        soa = st.session_state.offers_soa
+        if st.button("Expiring Soon (≤7 days)") and soa is not None:
+            set_filtered_offers(offers_from_rows(soa, expiring_soon_rows(soa)))
         
-        if st.button("High Value (>\\$50)"):
-            st.session_state.filtered_offers = [
-                o for o in (st.session_state.pending_offers or []) 
-                if safe_float(o.get('budget')) > 50
-            ]
+        if st.button("High Value (>\\$50)") and soa is not None:
+            set_filtered_offers(offers_from_rows(soa, high_value_rows(soa)))
     
     with col2:
         offers_to_display = st.session_state.filtered_offers if st.session_state.filtered_offers is not None else st.session_state.pending_offers
@@ -381,20 +805,14 @@ with tab2:
         if offers_to_display:
             st.subheader(f"📋 Offers ({len(offers_to_display)})")
             
-            # Improved sorting with proper error handling
-            def get_sort_key(offer):
-                expiry_date = offer.get('duration', {}).get('to')
-                try:
-                    if expiry_date and expiry_date != "No end date":
-                        return datetime.strptime(expiry_date, "%Y-%m-%d %H:%M")
-                    return datetime.max  # Far future date for offers with no expiry
-                except ValueError:
-                    return datetime.max  # Fallback for invalid dates
-            
-            offers_to_display.sort(key=get_sort_key)
+            # Only the shown pages are ordered; offers with no expiry carry datetime.max and come last
+            shown = st.session_state.page_size * st.session_state.page_index
+            render_offer_cards(heapq.nsmallest(shown, offers_to_display, key=operator.itemgetter('_expiry_dt')))
             
-            for offer in offers_to_display:
-                offer_card(offer)
+            if shown < len(offers_to_display):
+                if st.button(f"Show More ({len(offers_to_display) - shown} remaining)"):
+                    st.session_state.page_index += 1
+                    st.rerun(scope="fragment")
         else:
             if st.session_state.filtered_offers == []:
                 st.markdown("""
@@ -405,3 +823,14 @@ with tab2:
                 """, unsafe_allow_html=True)
             elif not st.session_state.pending_offers:
                 st.info("No offers available. Please refresh the page or check your connection.")
+
+with tab2:
+    st.title("Smart Offer Explorer")
+    st.caption("View, search, and analyze your offers using natural language")
+    
+    # Load offers automatically when tab is accessed
+    if not st.session_state.offers_loaded:
+        with st.spinner("Loading offers..."):
+            fetch_pending_offers()
+    
+    offers_panel()